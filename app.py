@@ -4,55 +4,133 @@ Converts video audio into AI-generated content using Google Gemini.
 Also supports direct video/audio download.
 """
 
+import io
 import os
 import sys
 import json
 import time
 import uuid
 import re
+import random
+import functools
+import collections
+import shutil
+import asyncio
 import logging
 import webbrowser
 import threading
+import subprocess
+import tempfile
+from urllib.parse import quote, urlsplit
+from logging.handlers import RotatingFileHandler
 
 import yt_dlp
+from yt_dlp.postprocessor import FFmpegPostProcessor
+from yt_dlp.utils import PostProcessingError
 import google.generativeai as genai
-from flask import Flask, render_template, request, jsonify, send_file
-from datetime import datetime
+from google.api_core import exceptions
+from googleapiclient.errors import HttpError
+from aiohttp import web
+from datetime import datetime, timedelta, timezone
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
+HISTORY_FILE = os.path.join(BASE_DIR, "history.json")
+UPLOADS_CACHE_FILE = os.path.join(BASE_DIR, "uploads_cache.json")
+LOG_FILE = os.path.join(BASE_DIR, "studio.log")
+TEMP_DIR = os.path.join(BASE_DIR, "tmp")
 
 # ──────────────────────────────────────────────
 # Logging
 # ──────────────────────────────────────────────
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s  %(levelname)-7s  %(message)s",
-    datefmt="%H:%M:%S",
-)
+_console_handler = logging.StreamHandler()
+_console_handler.setFormatter(logging.Formatter("{asctime}|{levelname}|{message}",
+                                                datefmt="%H:%M:%S", style="{"))
+# delay=True: studio.log is only created once something is logged
+_file_handler = RotatingFileHandler(LOG_FILE, maxBytes=1024 * 1024, backupCount=3,
+                                    encoding="utf-8", delay=True)
+_file_handler.setFormatter(logging.Formatter("{asctime}|{levelname}|{message}", style="{"))
+logging.basicConfig(level=logging.INFO, handlers=[_console_handler, _file_handler])
 log = logging.getLogger("studio")
 
 # ──────────────────────────────────────────────
 # App Setup
 # ──────────────────────────────────────────────
-app = Flask(__name__)
+app = web.Application()
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
-HISTORY_FILE = os.path.join(BASE_DIR, "history.json")
-TEMP_DIR = os.path.join(BASE_DIR, "tmp")
 MAX_AUDIO_SIZE_MB = 20
 MAX_HISTORY_ITEMS = 50
+MAX_GEMINI_RETRIES = 3
+MAX_FILE_PROCESSING_WAIT_S = 120
+MAX_CONCURRENT_JOBS = 4
+GEMINI_REQUESTS_PER_MINUTE = 15  # free-tier RPM
+JOB_TTL_S = 3600          # finished jobs and temp files are dropped after this
+CLEANUP_INTERVAL_S = 60
+UPLOAD_REUSE_MARGIN = timedelta(hours=2)  # Gemini keeps uploads for 48 h
 
 # Ensure temp directory exists
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# Hand downloads to aria2c (multi-connection) when it is installed
+_ARIA2C_OPTS = {
+    "external_downloader": "aria2c",
+    "external_downloader_args": {"aria2c": ["-x", "16", "-s", "16", "-k", "1M"]},
+} if shutil.which("aria2c") else {}
+
 AVAILABLE_MODELS = [
     {"id": "gemini-2.0-flash",      "name": "Gemini 2.0 Flash",      "desc": "Best speed & quality balance"},
     {"id": "gemini-2.0-flash-lite", "name": "Gemini 2.0 Flash Lite", "desc": "Fastest, lowest latency"},
     {"id": "gemini-2.5-flash",      "name": "Gemini 2.5 Flash",      "desc": "Latest experimental model"},
 ]
+_VALID_MODEL_IDS = frozenset(m["id"] for m in AVAILABLE_MODELS)
+
+# asyncio locks/semaphores below are created by _create_async_primitives on
+# startup: on Python 3.9 they bind to the loop that is current when built,
+# and web.run_app runs on a fresh one.
 
-# Thread-safe job tracking
+# Job tracking — only touched from the event loop
 _jobs: dict = {}
-_jobs_lock = threading.Lock()
+_jobs_lock = None
+_jobs_changed = None
+
+# Serialises config writes, which run in worker threads
+_config_lock = None
+
+# Same for uploads_cache.json read-modify-writes
+_uploads_lock = None
+
+# GenerativeModel instances by id; each keeps its SDK client (and connection)
+# once used. Only touched from the event loop, so no lock is needed.
+_MODEL_POOL: dict = {}
+_configured_api_key = None
+
+# At most MAX_CONCURRENT_JOBS jobs run at once; the rest wait their turn
+_job_slots = None
+
+# Start times of recent generate_content calls (rolling one-minute window)
+_gemini_calls = collections.deque()
+_gemini_rate_lock = None
+
+# Downloads get a narrower gate than whole jobs, so while some jobs upload or
+# generate, the next ones can already be downloading. Uploads need no gate of
+# their own; _job_slots already bounds them. Every ffmpeg post-processing
+# step (MP3 transcode, audio extraction, video merge) runs one at a time; it
+# happens inside executor threads, so its gate is a threading semaphore.
+_download_slots = None
+_ffmpeg_slots = threading.BoundedSemaphore(1)
+
+# Strong references to running job tasks so they aren't garbage-collected
+_tasks: set = set()
+
+# In-memory config, re-read only when config.json changes on disk
+_config: dict = None
+_config_mtime = None
+
+# In-memory history, written back to disk by a background task
+_history: list = None
+_history_mtime = None
+_history_dirty = False
+_history_flush_task = None
 
 # ──────────────────────────────────────────────
 # Utility functions
@@ -78,62 +156,210 @@ def _save_json(path, data):
     os.replace(tmp, path)
 
 
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
 def load_config() -> dict:
-    return _load_json(CONFIG_FILE, dict)
+    """Return the cached config, re-reading the file only if it was edited externally."""
+    global _config, _config_mtime
+    mtime = _mtime(CONFIG_FILE)
+    if _config is None or mtime != _config_mtime:
+        _config = _load_json(CONFIG_FILE, dict)
+        _config_mtime = mtime
+    return _config
 
 
 def save_config(patch: dict):
-    cfg = load_config()
-    cfg.update(patch)
+    global _config, _config_mtime
+    cfg = {**load_config(), **patch}
     _save_json(CONFIG_FILE, cfg)
+    _config, _config_mtime = cfg, _mtime(CONFIG_FILE)
+
+
+async def save_config_async(patch: dict):
+    """save_config() off the event loop, so disk writes don't stall other requests."""
+    async with _config_lock:
+        await asyncio.to_thread(save_config, patch)
 
 
 def load_history() -> list:
-    return _load_json(HISTORY_FILE, list)
+    """Return the cached history, re-reading the file only if it was edited externally."""
+    global _history, _history_mtime
+    if _history is None or (not _history_dirty and _mtime(HISTORY_FILE) != _history_mtime):
+        _history = _load_json(HISTORY_FILE, list)
+        _history_mtime = _mtime(HISTORY_FILE)
+    return _history
+
+
+def set_history(history: list):
+    """Replace the cached history and schedule a write to disk."""
+    global _history, _history_dirty, _history_flush_task
+    _history = history
+    _history_dirty = True
+    if _history_flush_task is None or _history_flush_task.done():
+        _history_flush_task = _spawn(_flush_history())
 
 
 def save_history_entry(entry: dict):
-    history = load_history()
-    history.insert(0, entry)
-    _save_json(HISTORY_FILE, history[:MAX_HISTORY_ITEMS])
+    set_history([entry] + load_history()[:MAX_HISTORY_ITEMS - 1])
 
 
-def detect_platform(url: str) -> str:
-    """Return a platform name from the URL domain."""
-    url = url.lower()
-    for domain, name in [
-        ("facebook.com", "facebook"), ("fb.watch", "facebook"), ("fb.com", "facebook"),
-        ("youtube.com", "youtube"),   ("youtu.be", "youtube"),
-        ("instagram.com", "instagram"),
-        ("tiktok.com", "tiktok"),
-        ("twitter.com", "twitter"),   ("x.com", "twitter"),
-    ]:
-        if domain in url:
-            return name
-    return "other"
-
-
-_URL_RE = re.compile(
-    r"^https?://"
-    r"(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|"
-    r"localhost|"
-    r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})"
-    r"(?::\d+)?"
-    r"(?:/?|[/?]\S+)$",
+async def _flush_history():
+    """Write the cached history until no further changes arrive mid-write."""
+    global _history_dirty, _history_mtime
+    while _history_dirty:
+        _history_dirty = False
+        try:
+            await asyncio.to_thread(_save_json, HISTORY_FILE, list(_history))
+        except OSError:
+            # Leave it dirty so the next history change retries the write
+            log.exception("Could not write %s", HISTORY_FILE)
+            _history_dirty = True
+            return
+        _history_mtime = _mtime(HISTORY_FILE)
+
+
+def load_upload_cache() -> dict:
+    """Return {video_url: upload info} for Gemini uploads that are not about to expire."""
+    cache = _load_json(UPLOADS_CACHE_FILE, dict)
+    if not isinstance(cache, dict):
+        log.warning("Ignoring malformed %s", UPLOADS_CACHE_FILE)
+        return {}
+    cutoff = datetime.now(timezone.utc) + UPLOAD_REUSE_MARGIN
+    fresh = {}
+    for url, entry in cache.items():
+        try:
+            expiration = datetime.fromisoformat(entry["expiration"])
+        except (TypeError, KeyError, ValueError):
+            continue  # hand-edited or partially written entry
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=timezone.utc)
+        if expiration > cutoff:
+            fresh[url] = entry
+    return fresh
+
+
+def remember_upload(video_url: str, uploaded, video_title: str) -> bool:
+    """Cache *uploaded* for reuse; return False if it has no known expiry."""
+    expiration = uploaded.expiration_time
+    if expiration is None:
+        return False
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=timezone.utc)
+    cache = load_upload_cache()
+    cache[video_url] = {
+        "name": uploaded.name,
+        "uri": uploaded.uri,
+        "expiration": expiration.isoformat(),
+        "video_title": video_title,
+    }
+    _save_json(UPLOADS_CACHE_FILE, cache)
+    return True
+
+
+def forget_upload(video_url: str):
+    cache = load_upload_cache()
+    if cache.pop(video_url, None) is not None:
+        _save_json(UPLOADS_CACHE_FILE, cache)
+
+
+async def remember_upload_async(video_url: str, uploaded, video_title: str) -> bool:
+    """remember_upload() off the event loop."""
+    async with _uploads_lock:
+        return await asyncio.to_thread(remember_upload, video_url, uploaded, video_title)
+
+
+async def forget_upload_async(video_url: str):
+    """forget_upload() off the event loop."""
+    async with _uploads_lock:
+        await asyncio.to_thread(forget_upload, video_url)
+
+
+# One capture group per platform, in the same order as _PLATFORM_NAMES
+_PLATFORM_RE = re.compile(
+    r"(facebook\.com|fb\.watch|fb\.com)"
+    r"|(youtube\.com|youtu\.be)"
+    r"|(instagram\.com)"
+    r"|(tiktok\.com)"
+    r"|(twitter\.com|x\.com)",
     re.IGNORECASE,
 )
+_PLATFORM_NAMES = ("facebook", "youtube", "instagram", "tiktok", "twitter")
+
 
+def detect_platform(url: str) -> str:
+    """Return a platform name from the URL domain."""
+    m = _PLATFORM_RE.search(url)
+    return _PLATFORM_NAMES[m.lastindex - 1] if m else "other"
+
+
+MAX_URL_LENGTH = 2048
+
+
+@functools.lru_cache(maxsize=1024)
 def validate_url(url: str) -> bool:
-    return bool(_URL_RE.match(url))
+    """Accept absolute http(s) URLs with a host and no whitespace."""
+    if len(url) >= MAX_URL_LENGTH or " " in url or not url.isprintable():
+        return False
+    try:
+        parts = urlsplit(url)
+        return parts.scheme in ("http", "https") and bool(parts.hostname)
+    except ValueError:
+        return False
+
+
+def _error_details(exc) -> list:
+    """Return the google.rpc status details attached to a Gemini exception."""
+    details = getattr(exc, "details", None)
+    if details is None:
+        details = getattr(getattr(exc, "error", None), "details", None)
+    return list(details) if isinstance(details, (list, tuple)) else []
+
+
+def retry_delay_seconds(exc):
+    """Return RetryInfo.retryDelay from *exc* in seconds, or None if absent."""
+    for d in _error_details(exc):
+        if isinstance(d, dict):
+            if d.get("@type", "").endswith("RetryInfo"):
+                m = re.match(r"([\d.]+)s$", str(d.get("retryDelay", "")))
+                if m:
+                    return float(m.group(1))
+        elif hasattr(d, "retry_delay"):
+            return d.retry_delay.seconds + d.retry_delay.nanos / 1e9
+    return None
+
+
+def is_daily_quota(exc) -> bool:
+    """True if *exc* carries a QuotaFailure for a per-day quota (not worth retrying)."""
+    for d in _error_details(exc):
+        if isinstance(d, dict):
+            if not d.get("@type", "").endswith("QuotaFailure"):
+                continue
+            quota_ids = [v.get("quotaId", "") for v in d.get("violations", [])]
+        else:
+            quota_ids = [getattr(v, "quota_id", "") for v in getattr(d, "violations", [])]
+        if any("PerDay" in q for q in quota_ids):
+            return True
+    return False
 
 
 def parse_api_error(exc, model_id: str) -> str:
     """Convert a raw Gemini exception into a short, user-friendly string."""
     text = str(exc)
 
-    if "429" in text or "quota" in text.lower():
-        m = re.search(r"retry[_ ]?(?:in|delay)?[:\s]*(\d+)", text, re.IGNORECASE)
-        wait = m.group(1) if m else "60"
+    if isinstance(exc, exceptions.ResourceExhausted) or "429" in text or "quota" in text.lower():
+        if is_daily_quota(exc):
+            return f"Daily quota exhausted for {model_id}. Try again tomorrow or switch model."
+        delay = retry_delay_seconds(exc)
+        if delay is not None:
+            wait = str(round(delay))
+        else:
+            m = re.search(r"retry[_ ]?(?:in|delay)?[:\s]*(\d+)", text, re.IGNORECASE)
+            wait = m.group(1) if m else "60"
         return f"Rate limit reached for {model_id}. Wait ~{wait}s or switch model."
 
     if "401" in text or "api_key" in text.lower():
@@ -153,85 +379,322 @@ def parse_api_error(exc, model_id: str) -> str:
 
 def resource_path(relative_path: str) -> str:
     """Resolve resource path for both dev and PyInstaller builds."""
-    base = getattr(sys, "_MEIPASS", os.path.abspath("."))
+    base = getattr(sys, "_MEIPASS", BASE_DIR)
     return os.path.join(base, relative_path)
 
 
 # ──────────────────────────────────────────────
-# Core processing (runs in background thread)
+# Core processing (runs as event-loop tasks)
 # ──────────────────────────────────────────────
 
-def _update_job(job_id: str, **fields):
-    with _jobs_lock:
+async def _update_job(job_id: str, **fields):
+    if fields.get("status") in ("done", "error"):
+        fields["finished_at"] = time.time()
+    async with _jobs_changed:
         if job_id in _jobs:
             _jobs[job_id].update(fields)
+            _jobs_changed.notify_all()
 
 
-def _process_video(job_id, video_url, lang, style, api_key, model_id, custom_instruction):
-    """Download audio → upload to Gemini → generate content. Called in a daemon thread."""
-    audio_path = None
-    uploaded = None
-    try:
-        # Step 1 — Download audio
-        _update_job(job_id, step="downloading", progress=10,
-                    message="Downloading audio from video...")
-        log.info("[%s] Downloading %s", job_id, video_url)
+def _configure_genai(api_key: str):
+    """Point the SDK at *api_key*, re-configuring only when the key changes."""
+    global _configured_api_key
+    if api_key != _configured_api_key:
+        genai.configure(api_key=api_key)
+        _configured_api_key = api_key
+        _MODEL_POOL.clear()  # pooled models hold clients for the old key
 
-        ts = int(time.time())
-        out_template = os.path.join(TEMP_DIR, f"audio_{ts}")
-
-        ydl_opts = {
-            "format": "bestaudio/best",
-            "outtmpl": out_template,
-            "postprocessors": [{
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "128",
-            }],
-            "quiet": True,
-            "no_warnings": True,
-        }
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
-            video_title = info.get("title", "Untitled")
+def _get_model(model_id: str):
+    model = _MODEL_POOL.get(model_id)
+    if model is None:
+        model = _MODEL_POOL[model_id] = genai.GenerativeModel(model_id)
+    return model
 
-        audio_path = out_template + ".mp3"
 
-        if not os.path.exists(audio_path):
-            _update_job(job_id, status="error", step="failed", progress=0,
-                        error="Could not download audio. Check if the video is public.")
-            return
+def _spawn(coro):
+    """Schedule *coro* on the running loop and keep a reference until it ends."""
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
 
-        size_mb = os.path.getsize(audio_path) / (1024 * 1024)
-        if size_mb > MAX_AUDIO_SIZE_MB:
-            _update_job(job_id, status="error", step="failed", progress=0,
-                        error=f"Audio too large ({size_mb:.1f} MB). Max {MAX_AUDIO_SIZE_MB} MB.")
-            return
 
-        # Step 2 — Upload to Gemini
-        _update_job(job_id, progress=30, step="uploading",
-                    message="Uploading audio to AI engine...")
-        log.info("[%s] Uploading %.1f MB", job_id, size_mb)
+async def _run_queued(coro):
+    """Await *coro* once a job slot is free; the job shows as queued until then."""
+    async with _job_slots:
+        await coro
+
+
+def _start_job(coro):
+    """Queue a job worker behind the MAX_CONCURRENT_JOBS limit."""
+    _spawn(_run_queued(coro))
+
+
+async def _gemini_rate_limit():
+    """Wait until another request fits in the GEMINI_REQUESTS_PER_MINUTE window."""
+    async with _gemini_rate_lock:
+        while len(_gemini_calls) >= GEMINI_REQUESTS_PER_MINUTE:
+            wait = _gemini_calls[0] + 60 - time.monotonic()
+            if wait <= 0:
+                _gemini_calls.popleft()
+            else:
+                await asyncio.sleep(wait)
+        _gemini_calls.append(time.monotonic())
+
+
+class _GatedYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL whose ffmpeg post-processors (including merges) hold _ffmpeg_slots."""
+
+    def run_pp(self, pp, infodict):
+        if isinstance(pp, FFmpegPostProcessor):
+            with _ffmpeg_slots:
+                return super().run_pp(pp, infodict)
+        return super().run_pp(pp, infodict)
+
+
+def _ydl_extract(ydl_opts: dict, url: str, postprocessors=()) -> dict:
+    """Blocking yt-dlp download; run through ``run_in_executor``."""
+    with _GatedYoutubeDL(ydl_opts) as ydl:
+        for pp in postprocessors:
+            ydl.add_post_processor(pp, when="post_process")
+        return ydl.extract_info(url, download=True)
+
+
+class _AudioBufferPP(FFmpegPostProcessor):
+    """Transcode the downloaded audio to MP3 straight into an in-memory buffer.
+
+    No .mp3 is written to disk. Reading stops once *limit* bytes have been
+    buffered, so oversize audio never fills memory. The source file is handed
+    back to yt-dlp for deletion.
+    """
+
+    def __init__(self, buf, limit, downloader=None):
+        super().__init__(downloader)
+        self.buf = buf
+        self.limit = limit
+        self.truncated = False
+
+    def set_downloader(self, downloader):
+        # ffmpeg is located in __init__; redo it so the YoutubeDL's options apply
+        super().set_downloader(downloader)
+        self._paths = self._determine_executables()
+
+    def run(self, info):
+        if not self.available:
+            raise PostProcessingError("ffmpeg not found. Please install ffmpeg.")
+        source = info["filepath"]
+        cmd = [self.executable, "-nostdin", "-loglevel", "error", "-i", source,
+               "-vn", "-c:a", "libmp3lame", "-b:a", "128k", "-f", "mp3", "pipe:1"]
+        # stderr goes to a file so a chatty ffmpeg can't block while we read stdout
+        with tempfile.TemporaryFile() as err, subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err) as proc:
+            while chunk := proc.stdout.read(1 << 16):
+                self.buf.write(chunk)
+                if self.buf.tell() > self.limit:
+                    self.truncated = True
+                    proc.kill()
+                    break
+            proc.wait()
+            err.seek(0)
+            stderr = err.read()
+        if proc.returncode and not self.truncated:
+            raise PostProcessingError(stderr.decode(errors="replace").strip()[-300:] or "ffmpeg failed")
+        return [source], info
+
+
+# Transient Gemini failures worth retrying; 401/403/404 and friends are not.
+_RETRYABLE_ERRORS = (
+    exceptions.ResourceExhausted,
+    exceptions.ServiceUnavailable,
+    exceptions.InternalServerError,
+)
 
-        genai.configure(api_key=api_key)
-        uploaded = genai.upload_file(path=audio_path)
 
-        _update_job(job_id, progress=50, step="processing",
-                    message="AI is analyzing the audio...")
+def _upload_audio(audio_buf, display_name):
+    """Upload the MP3 buffer to Gemini, raising api_core errors like the other SDK calls.
 
-        while uploaded.state.name == "PROCESSING":
-            time.sleep(1)
-            uploaded = genai.get_file(uploaded.name)
+    genai.upload_file goes through googleapiclient, whose HttpError would
+    otherwise slip past _RETRYABLE_ERRORS.
+    """
+    audio_buf.seek(0)  # rewind on every retry attempt
+    try:
+        return genai.upload_file(audio_buf, mime_type="audio/mpeg", display_name=display_name)
+    except HttpError as e:
+        status = int(e.resp.status)
+        if status == 429:
+            raise exceptions.ResourceExhausted(str(e)) from e
+        raise exceptions.from_http_status(status, str(e)) from e
+
+
+async def _gemini_call_with_retry(job_id, fn, *args, max_retries=MAX_GEMINI_RETRIES,
+                                  rate_limited=False, **kwargs):
+    """Run a blocking Gemini SDK call in a thread, retrying transient failures.
+
+    5xx errors back off 1s, 2s, 4s (plus jitter). Rate limits wait for the
+    server's RetryInfo delay plus a small buffer when one is given, and
+    per-day quota failures are raised straight away. With *rate_limited*,
+    every attempt also counts against GEMINI_REQUESTS_PER_MINUTE.
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limited:
+            await _gemini_rate_limit()
+        try:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        except _RETRYABLE_ERRORS as e:
+            if attempt == max_retries or is_daily_quota(e):
+                raise
+            if isinstance(e, exceptions.ResourceExhausted):
+                delay = retry_delay_seconds(e)
+                if delay is None:
+                    delay = min(10 * 2 ** attempt, 60) + random.random()
+                else:
+                    delay += random.uniform(1, 2)
+                message = f"Rate limit hit, retrying in {delay:.0f}s..."
+            else:
+                delay = 2 ** attempt + random.random()
+                message = f"AI service busy, retrying in {delay:.0f}s..."
+            log.warning("[%s] %s failed (%s), retrying in %.1fs (attempt %d/%d)",
+                        job_id, getattr(fn, "__name__", "Gemini call"), type(e).__name__,
+                        delay, attempt + 1, max_retries)
+            await _update_job(job_id, message=message)
+            await asyncio.sleep(delay)
+
+
+async def _reuse_upload(job_id, video_url):
+    """Return (file, title) for a still-usable earlier upload of *video_url*, or None."""
+    entry = (await asyncio.to_thread(load_upload_cache)).get(video_url)
+    if not entry:
+        return None
+    try:
+        uploaded = await _gemini_call_with_retry(job_id, genai.get_file, entry["name"])
+    except exceptions.GoogleAPICallError as e:
+        log.info("[%s] Cached upload %s unusable: %s", job_id, entry["name"], e)
+        uploaded = None
+    if uploaded is None or uploaded.state.name != "ACTIVE":
+        await forget_upload_async(video_url)
+        return None
+    return uploaded, entry["video_title"]
+
+
+async def _download_audio(job_id, video_url, audio_buf, ts):
+    """Fetch the audio track and transcode it into *audio_buf*.
+
+    Returns the video title, or None after marking the job as failed.
+    """
+    out_template = os.path.join(TEMP_DIR, f"audio_{ts}")
+    max_bytes = MAX_AUDIO_SIZE_MB * 1024 * 1024
+    oversize = {}
+
+    def reject_oversize(info, *, incomplete=False):
+        # Runs on the selected format before any media bytes are fetched. A muxed
+        # fallback's size is mostly video, so estimate its audio track instead.
+        if info.get("vcodec") in (None, "none"):
+            size = info.get("filesize") or info.get("filesize_approx")
+        elif info.get("abr") and info.get("duration"):
+            size = info["abr"] * 1000 / 8 * info["duration"]
+        else:
+            size = None  # _AudioBufferPP's byte cap still applies
+        if not incomplete and size and size > max_bytes:
+            oversize["bytes"] = size
+            return "Audio exceeds the size limit"
+        return None
+
+    ydl_opts = {
+        # Prefer audio-only formats; muxed "best" is only for sources without any
+        "format": "bestaudio[ext=m4a]/bestaudio/best",
+        "outtmpl": out_template,
+        "noplaylist": True,
+        "updatetime": False,  # keep mtime = download time for the tmp/ sweep
+        "concurrent_fragment_downloads": 8,
+        "http_chunk_size": 10485760,
+        "retries": 3,
+        "fragment_retries": 3,
+        "match_filter": reject_oversize,
+        **_ARIA2C_OPTS,
+        "quiet": True,
+        "no_warnings": True,
+    }
+    to_mp3 = _AudioBufferPP(audio_buf, max_bytes)
+
+    async with _download_slots:
+        loop = asyncio.get_running_loop()
+        info = await loop.run_in_executor(None, _ydl_extract, ydl_opts, video_url, [to_mp3])
+
+    if oversize:
+        await _update_job(job_id, status="error", step="failed", progress=0,
+                          error=f"Audio too large ({oversize['bytes'] / (1024 * 1024):.1f} MB). Max {MAX_AUDIO_SIZE_MB} MB.")
+        return None
+
+    if to_mp3.truncated:
+        await _update_job(job_id, status="error", step="failed", progress=0,
+                          error=f"Audio too large (over {MAX_AUDIO_SIZE_MB} MB). Max {MAX_AUDIO_SIZE_MB} MB.")
+        return None
+
+    if not audio_buf.tell():
+        await _update_job(job_id, status="error", step="failed", progress=0,
+                          error="Could not download audio. Check if the video is public.")
+        return None
+
+    return info.get("title", "Untitled")
+
+
+async def _process_video(job_id, video_url, lang, style, api_key, model_id, custom_instruction):
+    """Download audio → upload to Gemini → generate content. Runs as an asyncio task."""
+    audio_buf = io.BytesIO()
+    uploaded = None
+    reused = None
+    keep_remote = False  # successful uploads stay on Gemini for reuse
+    try:
+        _configure_genai(api_key)
+
+        reused = await _reuse_upload(job_id, video_url)
+        if reused:
+            uploaded, video_title = reused
+            keep_remote = True
+            log.info("[%s] Reusing uploaded audio %s", job_id, uploaded.name)
+        else:
+            # Step 1 — Download audio
+            await _update_job(job_id, step="downloading", progress=10,
+                              message="Downloading audio from video...")
+            log.info("[%s] Downloading %s", job_id, video_url)
+
+            ts = int(time.time())
+            video_title = await _download_audio(job_id, video_url, audio_buf, ts)
+            if video_title is None:
+                return
+
+            size_mb = audio_buf.tell() / (1024 * 1024)
+
+            # Step 2 — Upload to Gemini
+            await _update_job(job_id, progress=30, step="uploading",
+                              message="Uploading audio to AI engine...")
+            log.info("[%s] Uploading %.1f MB", job_id, size_mb)
+
+            uploaded = await _gemini_call_with_retry(job_id, _upload_audio, audio_buf, f"audio_{ts}.mp3")
+
+            await _update_job(job_id, progress=50, step="processing",
+                              message="AI is analyzing the audio...")
+
+            # Poll with backoff (0.25s → 5s) instead of once a second
+            delay = 0.25
+            deadline = time.monotonic() + MAX_FILE_PROCESSING_WAIT_S
+            while uploaded.state.name == "PROCESSING":
+                if time.monotonic() >= deadline:
+                    await _update_job(job_id, status="error", step="failed", progress=0,
+                                      error="AI took too long to process the audio file. Try again.")
+                    return
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+                uploaded = await _gemini_call_with_retry(job_id, genai.get_file, uploaded.name)
 
         if uploaded.state.name == "FAILED":
-            _update_job(job_id, status="error", step="failed", progress=0,
-                        error="AI failed to process the audio file.")
+            await _update_job(job_id, status="error", step="failed", progress=0,
+                              error="AI failed to process the audio file.")
             return
 
         # Step 3 — Generate content
-        _update_job(job_id, progress=70, step="generating",
-                    message="Generating content with AI...")
+        await _update_job(job_id, progress=70, step="generating",
+                          message="Generating content with AI...")
         log.info("[%s] Generating (%s, %s, %s)", job_id, model_id, style, lang)
 
         if style == "Transcript":
@@ -263,21 +726,22 @@ def _process_video(job_id, video_url, lang, style, api_key, model_id, custom_ins
         else:
             prompt = system_prompt
 
-        valid_ids = [m["id"] for m in AVAILABLE_MODELS]
-        if model_id not in valid_ids:
+        if model_id not in _VALID_MODEL_IDS:
             model_id = "gemini-2.0-flash"
 
         try:
-            model = genai.GenerativeModel(model_id)
-            response = model.generate_content([prompt, uploaded])
+            model = _get_model(model_id)
+            response = await _gemini_call_with_retry(job_id, model.generate_content, [prompt, uploaded],
+                                                     rate_limited=True)
             result_text = response.text
         except Exception as e:
             if "not found" in str(e).lower() or "404" in str(e):
                 log.warning("[%s] Model %s not found, falling back to gemini-2.0-flash", job_id, model_id)
-                _update_job(job_id, message="Model unavailable, trying fallback (Gemini 2.0 Flash)...")
+                await _update_job(job_id, message="Model unavailable, trying fallback (Gemini 2.0 Flash)...")
                 try:
-                    model = genai.GenerativeModel("gemini-2.0-flash")
-                    response = model.generate_content([prompt, uploaded])
+                    model = _get_model("gemini-2.0-flash")
+                    response = await _gemini_call_with_retry(job_id, model.generate_content, [prompt, uploaded],
+                                                             rate_limited=True)
                     result_text = response.text
                     model_id = "gemini-2.0-flash (fallback)"
                 except Exception as e2:
@@ -287,41 +751,49 @@ def _process_video(job_id, video_url, lang, style, api_key, model_id, custom_ins
                 raise e
 
         # Step 4 — Done
-        _update_job(job_id, status="done", step="done", progress=100,
-                    message="Content generated successfully!",
-                    result=result_text, video_title=video_title)
-        log.info("[%s] Done — %d words", job_id, len(result_text.split()))
-
-        save_history_entry({
-            "id": job_id,
-            "url": video_url,
-            "platform": detect_platform(video_url),
-            "video_title": video_title,
-            "model": model_id,
-            "lang": lang,
-            "style": style,
-            "result": result_text,
-            "word_count": len(result_text.split()),
-            "timestamp": datetime.now().isoformat(),
-        })
+        await _update_job(job_id, status="done", step="done", progress=100,
+                          message="Content generated successfully!",
+                          result=result_text, video_title=video_title)
+        word_count = len(result_text.split())
+        log.info("[%s] Done — %d words", job_id, word_count)
+
+        # The job is already done; bookkeeping failures must not flip it to error
+        try:
+            save_history_entry({
+                "id": job_id,
+                "url": video_url,
+                "platform": detect_platform(video_url),
+                "video_title": video_title,
+                "model": model_id,
+                "lang": lang,
+                "style": style,
+                "result": result_text,
+                "word_count": word_count,
+                "timestamp": datetime.now().isoformat(),
+            })
+        except Exception:
+            log.exception("[%s] Could not save history entry", job_id)
+        if not keep_remote:
+            try:
+                keep_remote = await remember_upload_async(video_url, uploaded, video_title)
+            except Exception:
+                log.exception("[%s] Could not cache upload for reuse", job_id)
 
     except Exception as exc:
         log.exception("[%s] Processing failed", job_id)
-        _update_job(job_id, status="error", step="failed", progress=0,
-                    error=parse_api_error(exc, model_id))
+        if reused and isinstance(exc, (exceptions.InvalidArgument, exceptions.PermissionDenied,
+                                       exceptions.NotFound)):
+            await forget_upload_async(video_url)  # likely expired; upload afresh next time
+        await _update_job(job_id, status="error", step="failed", progress=0,
+                          error=parse_api_error(exc, model_id))
     finally:
-        # Cleanup local file
-        if audio_path and os.path.exists(audio_path):
-            try:
-                os.remove(audio_path)
-            except OSError:
-                log.warning("Could not remove temp file %s", audio_path)
-        
-        # Cleanup remote Gemini file
-        if uploaded:
+        audio_buf.close()
+
+        # Cleanup remote Gemini file unless it is cached for reuse
+        if uploaded and not keep_remote:
             try:
                 log.info("[%s] Deleting remote file %s", job_id, uploaded.name)
-                uploaded.delete()
+                await asyncio.to_thread(uploaded.delete)
             except Exception as e:
                 log.warning("[%s] Failed to delete remote file: %s", job_id, e)
 
@@ -330,11 +802,11 @@ def _process_video(job_id, video_url, lang, style, api_key, model_id, custom_ins
 # Download worker (video/audio without AI)
 # ──────────────────────────────────────────────
 
-def _download_media(job_id, video_url, fmt):
+async def _download_media(job_id, video_url, fmt):
     """Download video or audio file. fmt = 'video' | 'audio'."""
     try:
-        _update_job(job_id, step="downloading", progress=20,
-                    message=f"Downloading {fmt} from video...")
+        await _update_job(job_id, step="downloading", progress=20,
+                          message=f"Downloading {fmt} from video...")
         log.info("[%s] Downloading %s as %s", job_id, video_url[:60], fmt)
 
         ts = int(time.time())
@@ -343,8 +815,13 @@ def _download_media(job_id, video_url, fmt):
             ext = "mp3"
             out_template = os.path.join(TEMP_DIR, f"dl_{ts}")
             ydl_opts = {
-                "format": "bestaudio/best",
+                "format": "bestaudio[ext=m4a]/bestaudio/best",
                 "outtmpl": out_template,
+                "noplaylist": True,
+                "updatetime": False,
+                "concurrent_fragment_downloads": 8,
+                "http_chunk_size": 10485760,
+                **_ARIA2C_OPTS,
                 "postprocessors": [{
                     "key": "FFmpegExtractAudio",
                     "preferredcodec": "mp3",
@@ -361,14 +838,20 @@ def _download_media(job_id, video_url, fmt):
                 "format": "bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best",
                 "outtmpl": out_template,
                 "merge_output_format": "mp4",
+                "noplaylist": True,
+                "updatetime": False,
+                "concurrent_fragment_downloads": 8,
+                "http_chunk_size": 10485760,
+                **_ARIA2C_OPTS,
                 "quiet": True,
                 "no_warnings": True,
             }
             expected_path = None  # will find after download
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url, download=True)
-            video_title = info.get("title", "download")
+        async with _download_slots:
+            loop = asyncio.get_running_loop()
+            info = await loop.run_in_executor(None, _ydl_extract, ydl_opts, video_url)
+        video_title = info.get("title", "download")
 
         # Find the downloaded file
         if fmt == "audio":
@@ -382,43 +865,97 @@ def _download_media(job_id, video_url, fmt):
                 ext = os.path.splitext(dl_path)[1].lstrip(".")
 
         if not dl_path or not os.path.exists(dl_path):
-            _update_job(job_id, status="error", step="failed", progress=0,
-                        error="Download failed. The video may be private or unavailable.")
+            await _update_job(job_id, status="error", step="failed", progress=0,
+                              error="Download failed. The video may be private or unavailable.")
             return
 
         size_mb = os.path.getsize(dl_path) / (1024 * 1024)
         safe_title = re.sub(r'[^\w\s\-]', '', video_title).strip()[:60] or "download"
         filename = f"{safe_title}.{ext}"
 
-        _update_job(job_id, status="done", step="done", progress=100,
-                    message=f"{fmt.capitalize()} ready to download ({size_mb:.1f} MB)",
-                    video_title=video_title,
-                    download_path=dl_path,
-                    download_filename=filename,
-                    download_size_mb=round(size_mb, 1))
+        await _update_job(job_id, status="done", step="done", progress=100,
+                          message=f"{fmt.capitalize()} ready to download ({size_mb:.1f} MB)",
+                          video_title=video_title,
+                          download_path=dl_path,
+                          download_filename=filename,
+                          download_size_mb=round(size_mb, 1))
         log.info("[%s] Download ready: %s (%.1f MB)", job_id, filename, size_mb)
 
     except Exception as exc:
         log.exception("[%s] Download failed", job_id)
-        _update_job(job_id, status="error", step="failed", progress=0,
-                    error=f"Download failed: {str(exc)[:150]}")
+        await _update_job(job_id, status="error", step="failed", progress=0,
+                          error=f"Download failed: {str(exc)[:150]}")
+
+
+# ──────────────────────────────────────────────
+# Housekeeping (expired jobs + stale temp files)
+# ──────────────────────────────────────────────
+
+_cleanup_task = None
+
+
+def _remove_stale_temp_files(max_age: float) -> int:
+    """Delete files in TEMP_DIR not written or created for *max_age* seconds.
+
+    ctime is checked as well as mtime: a timestamp copied from the source
+    (e.g. Last-Modified) would make a fresh file look old.
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    with os.scandir(TEMP_DIR) as entries:
+        for entry in entries:
+            try:
+                st = entry.stat()
+                if entry.is_file() and max(st.st_mtime, st.st_ctime) < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                log.warning("Could not remove temp file %s", entry.path)
+    return removed
+
+
+async def _cleanup_loop():
+    """Periodically forget finished jobs and delete leftover temp files."""
+    while True:
+        await asyncio.sleep(CLEANUP_INTERVAL_S)
+        try:
+            cutoff = time.time() - JOB_TTL_S
+            async with _jobs_changed:
+                expired = [j for j, job in _jobs.items() if job.get("finished_at", cutoff) < cutoff]
+                for job_id in expired:
+                    del _jobs[job_id]
+                if expired:
+                    _jobs_changed.notify_all()
+            removed = await asyncio.to_thread(_remove_stale_temp_files, JOB_TTL_S)
+            if expired or removed:
+                log.info("Cleanup: dropped %d finished jobs, removed %d temp files",
+                         len(expired), removed)
+        except Exception:
+            log.exception("Cleanup pass failed")
 
 
 # ──────────────────────────────────────────────
 # Routes
 # ──────────────────────────────────────────────
 
-@app.route("/")
-def index():
-    return render_template("index.html")
+async def _read_json(request) -> dict:
+    """Parse the request body as JSON, returning {} when absent or malformed."""
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def index(request):
+    return web.FileResponse(resource_path(os.path.join("templates", "index.html")))
 
 
 # — Config —
 
-@app.route("/api/config", methods=["GET"])
-def get_config():
+async def get_config(request):
     cfg = load_config()
-    return jsonify({
+    return web.json_response({
         "api_key":       cfg.get("api_key", ""),
         "default_model": cfg.get("default_model", "gemini-2.0-flash"),
         "default_lang":  cfg.get("default_lang", "Bengali"),
@@ -426,32 +963,29 @@ def get_config():
     })
 
 
-@app.route("/api/config", methods=["POST"])
-def post_config():
-    data = request.json or {}
+async def post_config(request):
+    data = await _read_json(request)
     if "api_key" in data and not data["api_key"].strip():
-        return jsonify({"success": False, "error": "API Key cannot be empty."}), 400
-    save_config(data)
-    return jsonify({"success": True})
+        return web.json_response({"success": False, "error": "API Key cannot be empty."}, status=400)
+    await save_config_async(data)
+    return web.json_response({"success": True})
 
 
 # — Models —
 
-@app.route("/api/models", methods=["GET"])
-def get_models():
-    return jsonify({"models": AVAILABLE_MODELS})
+async def get_models(request):
+    return web.json_response({"models": AVAILABLE_MODELS})
 
 
 # — Generate (async) —
 
-@app.route("/api/generate", methods=["POST"])
-def generate():
-    data = request.json or {}
+async def generate(request):
+    data = await _read_json(request)
     cfg = load_config()
     api_key = cfg.get("api_key")
 
     if not api_key:
-        return jsonify({"success": False, "error": "API Key not set. Open Settings."}), 401
+        return web.json_response({"success": False, "error": "API Key not set. Open Settings."}, status=401)
 
     url = data.get("url", "").strip()
     lang = data.get("lang", "Bengali")
@@ -460,17 +994,17 @@ def generate():
     custom_instruction = data.get("custom_instruction", "")
 
     if not url:
-        return jsonify({"success": False, "error": "URL is required."}), 400
+        return web.json_response({"success": False, "error": "URL is required."}, status=400)
     if not validate_url(url):
-        return jsonify({"success": False, "error": "Invalid URL format."}), 400
+        return web.json_response({"success": False, "error": "Invalid URL format."}, status=400)
 
     job_id = uuid.uuid4().hex[:8]
-    with _jobs_lock:
+    async with _jobs_lock:
         _jobs[job_id] = {
             "status": "running",
             "step": "queued",
             "progress": 0,
-            "message": "Starting…",
+            "message": "Waiting in queue…",
             "result": None,
             "error": None,
             "video_title": None,
@@ -478,73 +1012,94 @@ def generate():
             "platform": detect_platform(url),
         }
 
-    thread = threading.Thread(
-        target=_process_video,
-        args=(job_id, url, lang, style, api_key, model_id, custom_instruction),
-        daemon=True,
-    )
-    thread.start()
+    _start_job(_process_video(job_id, url, lang, style, api_key, model_id, custom_instruction))
     log.info("Job %s started for %s", job_id, url[:60])
 
     # Remember user preferences
-    save_config({"default_model": model_id, "default_lang": lang, "default_style": style})
+    await save_config_async({"default_model": model_id, "default_lang": lang, "default_style": style})
 
-    return jsonify({"success": True, "job_id": job_id})
+    return web.json_response({"success": True, "job_id": job_id})
 
 
-# — Job status (polling) —
+# — Job status (polling + server-sent events) —
 
-@app.route("/api/status/<job_id>", methods=["GET"])
-def job_status(job_id):
-    with _jobs_lock:
+async def job_status(request):
+    job_id = request.match_info["job_id"]
+    async with _jobs_lock:
         job = _jobs.get(job_id)
     if not job:
-        return jsonify({"error": "Job not found."}), 404
-    return jsonify(job)
+        return web.json_response({"error": "Job not found."}, status=404)
+    return web.json_response(job)
+
+
+async def job_status_stream(request):
+    """Push the job dict as an SSE event every time it changes, until it finishes."""
+    job_id = request.match_info["job_id"]
+    async with _jobs_lock:
+        if job_id not in _jobs:
+            return web.json_response({"error": "Job not found."}, status=404)
+
+    resp = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+    })
+    await resp.prepare(request)
+
+    last = None
+    try:
+        while True:
+            async with _jobs_changed:
+                await _jobs_changed.wait_for(lambda: _jobs.get(job_id) != last)
+                job = _jobs.get(job_id)
+                last = dict(job) if job else None
+            if last is None:
+                break
+            await resp.write(f"data: {json.dumps(last)}\n\n".encode("utf-8"))
+            if last["status"] in ("done", "error"):
+                break
+    except ConnectionResetError:
+        log.debug("Status stream for %s closed by client", job_id)
+    return resp
 
 
 # — History —
 
-@app.route("/api/history", methods=["GET"])
-def get_history():
-    return jsonify({"history": load_history()})
+async def get_history(request):
+    return web.json_response({"history": load_history()})
 
 
-@app.route("/api/history/<item_id>", methods=["DELETE"])
-def delete_history_item(item_id):
-    history = [h for h in load_history() if h.get("id") != item_id]
-    _save_json(HISTORY_FILE, history)
-    return jsonify({"success": True})
+async def delete_history_item(request):
+    item_id = request.match_info["item_id"]
+    set_history([h for h in load_history() if h.get("id") != item_id])
+    return web.json_response({"success": True})
 
 
-@app.route("/api/history", methods=["DELETE"])
-def clear_history():
-    _save_json(HISTORY_FILE, [])
-    return jsonify({"success": True})
+async def clear_history(request):
+    set_history([])
+    return web.json_response({"success": True})
 
 
 # — Download (video/audio) —
 
-@app.route("/api/download", methods=["POST"])
-def start_download():
-    data = request.json or {}
+async def start_download(request):
+    data = await _read_json(request)
     url = data.get("url", "").strip()
     fmt = data.get("format", "video")  # 'video' or 'audio'
 
     if not url:
-        return jsonify({"success": False, "error": "URL is required."}), 400
+        return web.json_response({"success": False, "error": "URL is required."}, status=400)
     if not validate_url(url):
-        return jsonify({"success": False, "error": "Invalid URL format."}), 400
+        return web.json_response({"success": False, "error": "Invalid URL format."}, status=400)
     if fmt not in ("video", "audio"):
-        return jsonify({"success": False, "error": "Format must be 'video' or 'audio'."}), 400
+        return web.json_response({"success": False, "error": "Format must be 'video' or 'audio'."}, status=400)
 
     job_id = uuid.uuid4().hex[:8]
-    with _jobs_lock:
+    async with _jobs_lock:
         _jobs[job_id] = {
             "status": "running",
             "step": "queued",
             "progress": 0,
-            "message": "Starting download…",
+            "message": "Waiting in queue…",
             "result": None,
             "error": None,
             "video_title": None,
@@ -555,33 +1110,106 @@ def start_download():
             "download_size_mb": None,
         }
 
-    thread = threading.Thread(
-        target=_download_media,
-        args=(job_id, url, fmt),
-        daemon=True,
-    )
-    thread.start()
+    _start_job(_download_media(job_id, url, fmt))
     log.info("Download job %s started (%s) for %s", job_id, fmt, url[:60])
 
-    return jsonify({"success": True, "job_id": job_id})
+    return web.json_response({"success": True, "job_id": job_id})
+
+
+class _DeleteAfterSendResponse(web.FileResponse):
+    """FileResponse that removes the file once it has been delivered in full.
+
+    The body is streamed with sendfile(2) where the platform supports it.
+    HEAD, Range and 304 responses leave the file in place.
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.file_path = path
+
+    async def prepare(self, request):
+        writer = await super().prepare(request)
+        if request.method == "GET" and self.status == 200:
+            try:
+                os.remove(self.file_path)
+            except OSError:
+                log.warning("Could not remove temp file %s", self.file_path)
+        return writer
 
 
-@app.route("/api/download/file/<job_id>", methods=["GET"])
-def serve_download(job_id):
-    with _jobs_lock:
+async def serve_download(request):
+    job_id = request.match_info["job_id"]
+    async with _jobs_lock:
         job = _jobs.get(job_id)
     if not job:
-        return jsonify({"error": "Job not found."}), 404
+        return web.json_response({"error": "Job not found."}, status=404)
     if job.get("status") != "done" or not job.get("download_path"):
-        return jsonify({"error": "File not ready."}), 400
+        return web.json_response({"error": "File not ready."}, status=400)
 
     path = job["download_path"]
     name = job.get("download_filename", "download")
 
     if not os.path.exists(path):
-        return jsonify({"error": "File expired. Please download again."}), 410
+        return web.json_response({"error": "File expired. Please download again."}, status=410)
+
+    ascii_name = name.encode("ascii", "ignore").decode() or "download"
+    return _DeleteAfterSendResponse(path, headers={
+        "Content-Disposition": f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(name)}",
+        "Cache-Control": "no-store",
+    })
+
+
+app.router.add_get("/", index)
+app.router.add_get("/api/config", get_config)
+app.router.add_post("/api/config", post_config)
+app.router.add_get("/api/models", get_models)
+app.router.add_post("/api/generate", generate)
+app.router.add_get("/api/status/{job_id}", job_status)
+app.router.add_get("/api/status/{job_id}/stream", job_status_stream)
+app.router.add_get("/api/history", get_history)
+app.router.add_delete("/api/history/{item_id}", delete_history_item)
+app.router.add_delete("/api/history", clear_history)
+app.router.add_post("/api/download", start_download)
+app.router.add_get("/api/download/file/{job_id}", serve_download)
+
+
+async def _create_async_primitives(app):
+    global _jobs_lock, _jobs_changed, _config_lock, _uploads_lock, _job_slots
+    global _gemini_rate_lock, _download_slots
+    _jobs_lock = asyncio.Lock()
+    _jobs_changed = asyncio.Condition(_jobs_lock)
+    _config_lock = asyncio.Lock()
+    _uploads_lock = asyncio.Lock()
+    _job_slots = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+    _gemini_rate_lock = asyncio.Lock()
+    _download_slots = asyncio.Semaphore(2)
+
+
+async def _configure_on_startup(app):
+    api_key = load_config().get("api_key")
+    if api_key:
+        _configure_genai(api_key)
+
+
+async def _start_cleanup(app):
+    global _cleanup_task
+    _cleanup_task = asyncio.create_task(_cleanup_loop())
+
+
+async def _stop_cleanup(app):
+    if _cleanup_task is not None:
+        _cleanup_task.cancel()
+
+
+async def _flush_on_cleanup(app):
+    if _history_flush_task is not None:
+        await _history_flush_task
 
-    return send_file(path, as_attachment=True, download_name=name)
+app.on_startup.append(_create_async_primitives)
+app.on_startup.append(_configure_on_startup)
+app.on_startup.append(_start_cleanup)
+app.on_cleanup.append(_stop_cleanup)
+app.on_cleanup.append(_flush_on_cleanup)
 
 
 # ──────────────────────────────────────────────
@@ -595,4 +1223,4 @@ def _open_browser():
 if __name__ == "__main__":
     threading.Timer(1.0, _open_browser).start()
     log.info("Starting FB AI Studio on http://127.0.0.1:5000")
-    app.run(host="127.0.0.1", port=5000, debug=False)
+    web.run_app(app, host="127.0.0.1", port=5000, print=None)
@@ -0,0 +1,46 @@
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+
+def _http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b'{"error": {"message": "busy"}}')
+
+
+class UploadRetryTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        await app._create_async_primitives(None)
+        app._jobs["job"] = {"status": "running"}
+
+    async def asyncTearDown(self):
+        app._jobs.pop("job", None)
+
+    @mock.patch("app.asyncio.sleep", new_callable=mock.AsyncMock)
+    async def test_upload_retried_after_503(self, _sleep):
+        uploaded = object()
+        with mock.patch("app.genai.upload_file",
+                        side_effect=[_http_error(503), uploaded]) as upload_file:
+            result = await app._gemini_call_with_retry("job", app._upload_audio,
+                                                       io.BytesIO(b"mp3"), "audio.mp3")
+        self.assertIs(result, uploaded)
+        self.assertEqual(upload_file.call_count, 2)
+
+    @mock.patch("app.asyncio.sleep", new_callable=mock.AsyncMock)
+    async def test_upload_client_error_not_retried(self, _sleep):
+        with mock.patch("app.genai.upload_file", side_effect=_http_error(400)) as upload_file:
+            with self.assertRaises(app.exceptions.BadRequest):
+                await app._gemini_call_with_retry("job", app._upload_audio,
+                                                  io.BytesIO(b"mp3"), "audio.mp3")
+        self.assertEqual(upload_file.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()